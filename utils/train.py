@@ -1,30 +1,71 @@
 #!/usr/bin/env python3
+from argparse import ArgumentParser
 from pathlib import Path
-from sys import argv
 import faiss
 import numpy as np
 
+D = 256
 
-def main():
-    if len(argv) != 3:
-        print(f"Usage: {argv[0]} K train.npy")
-        return
-
-    k = int(argv[1])
-    d = 256
-    quantizer = faiss.IndexBinaryFlat(d)
-    index = faiss.IndexBinaryIVF(quantizer, d, k)
-    clustering_index = faiss.index_cpu_to_all_gpus(faiss.IndexFlatL2(d))
+
+def train(tr, k, clustering_index):
+    # k-means runs on clustering_index, the quantizer is only filled with the
+    # centroids afterwards. HNSW makes assigning vectors to lists at add / search
+    # time O(log K) instead of O(K), at the cost of some recall
+    quantizer = faiss.IndexBinaryHNSW(D, 32)
+    # efSearch is saved with the index and can't be changed from imsearch, keep it
+    # no lower than the nprobe used for searching
+    quantizer.hnsw.efSearch = 128
+    index = faiss.IndexBinaryIVF(quantizer, D, k)
     index.clustering_index = clustering_index
 
-    tr = np.load(argv[2], mmap_mode="r")
+    # k-means only needs 30 ~ 256 points per centroid, so sample a subset
+    # instead of paging the whole file through memory
+    # (faiss itself warns when there are too few points for K)
+    ntrain = min(tr.shape[0], 256 * index.nlist)
+    if ntrain == tr.shape[0]:
+        xt = np.ascontiguousarray(tr)
+    else:
+        # seed like faiss does, so that training stays reproducible
+        rng = np.random.default_rng(index.cp.seed)
+        # sorted indices keep the mmap access sequential on disk
+        idx = rng.choice(tr.shape[0], ntrain, replace=False)
+        idx.sort()
+        xt = np.ascontiguousarray(tr[idx])
+
+    index.train(xt)
+    return index
+
+
+def main():
+    parser = ArgumentParser(description="Train the imsearch index")
+    parser.add_argument("k", type=int, nargs="+", metavar="K",
+                        help="number of inverted lists, several values train one index each")
+    parser.add_argument("train", help="training vectors exported by `imsearch export-data`")
+    parser.add_argument("-o", "--output", type=Path,
+                        help="output path, suffixed with `.K` when several K are given, "
+                             "defaults to ~/.config/imsearch/index for a single K")
+    args = parser.parse_args()
+    # imsearch loads every `index*` file in its config dir as a shard, so several
+    # trained-but-empty indexes must not be written there by default
+    if args.output is None:
+        if len(args.k) > 1:
+            parser.error("-o/--output is required when several K are given")
+        args.output = Path.home() / '.config/imsearch/index'
+
+    clustering_index = faiss.index_cpu_to_all_gpus(faiss.IndexFlatL2(D))
 
-    index.train(tr)
+    tr = np.load(args.train, mmap_mode="r")
 
-    dest = Path.home() / '.config/imsearch'
-    dest.mkdir(parents=True, exist_ok=True)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
 
-    faiss.write_index_binary(index, str(dest / 'index'))
+    # GPU resources and the mmap'd training set are shared by all runs
+    for k in args.k:
+        index = train(tr, k, clustering_index)
+        if len(args.k) == 1:
+            output = args.output
+        else:
+            output = args.output.with_name(f"{args.output.name}.{k}")
+        faiss.write_index_binary(index, str(output))
 
 
 if __name__ == '__main__':